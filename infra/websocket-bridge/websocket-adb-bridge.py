@@ -5,7 +5,6 @@ Converts WebSocket ADB connection to local TCP ADB for standard adb compatibilit
 """
 
 import asyncio
-import websockets
 import socket
 import sys
 import os
@@ -13,36 +12,106 @@ import threading
 import time
 import logging
 import ssl
+import re
+import signal
+from pathlib import Path
 from urllib.parse import urlparse
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
+
+# Use uvloop for faster socket I/O when available
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
+# SSL context for the Genymotion WebSocket, built once and reused across
+# reconnects. Certificate verification is disabled, so the unverified
+# context is used directly and the system CA bundle is never loaded.
+_SSL_CTX = ssl._create_unverified_context()
+
+# Connection file written by the Genymotion provisioning scripts
+CONNECTION_ENV_FILE = '/tmp/genymotion_connection.env'
+# Matches the ADB URL entry in the connection file, capturing the unquoted value
+_ENV_URL_RE = re.compile(
+    r'^\s*(?:export\s+)?(?:GENYMOTION_ADB_URL|publicAdbUrl)="?([^"\r\n]*)"?\s*$',
+    re.MULTILINE
+)
+
+# Pending connection backlog for the local ADB TCP server
+LISTEN_BACKLOG = 128
+# Read size for ADB client data, sized for bulk push/pull chunks
+READ_CHUNK_SIZE = 64 * 1024
+# Maximum WebSocket messages buffered per ADB client before the forwarder waits
+CLIENT_QUEUE_SIZE = 256
+# Maximum bytes coalesced into a single write to an ADB client
+WRITE_BATCH_SIZE = 64 * 1024
+# Seconds a congested ADB client may hold up its writes before it is dropped
+CLIENT_DRAIN_TIMEOUT = 0.5
+# Backoff bounds, in seconds, between WebSocket reconnect attempts
+RECONNECT_INITIAL_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+# Seconds a WebSocket connection must stay up before the backoff resets
+RECONNECT_STABLE_AFTER = 10
+
+class ADBClient:
+    """Local ADB client connection with its pending WebSocket messages"""
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+    
+    def close(self):
+        """Close the client connection"""
+        self._release_queue()
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+    
+    def abort(self):
+        """Close the client connection immediately, discarding unsent data"""
+        self._release_queue()
+        try:
+            self.writer.transport.abort()
+        except Exception:
+            pass
+    
+    def _release_queue(self):
+        """Empty the queue so a forwarder waiting on put() is not stuck"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
 class WebSocketADBBridge:
     def __init__(self, websocket_url: str, local_port: int = 5555):
         self.websocket_url = websocket_url
         self.local_port = local_port
-        self.server_socket = None
+        self.server = None
         self.websocket = None
         self.running = False
-        self.clients = []
+        self.clients: set[ADBClient] = set()
         
     async def connect_websocket(self):
         """Connect to Genymotion WebSocket ADB"""
         try:
             logger.info(f"Connecting to WebSocket ADB: {self.websocket_url}")
             
-            # Create SSL context that ignores certificate verification
-            ssl_context = ssl.create_default_context()
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
-            
-            self.websocket = await websockets.connect(
+            self.websocket = await connect(
                 self.websocket_url,
-                ssl=ssl_context,
+                ssl=_SSL_CTX,
                 ping_interval=30,
-                ping_timeout=10
+                ping_timeout=10,
+                # ADB traffic is binary and mostly incompressible
+                compression=None,
+                # Large ADB frames (APK pushes) must not be rejected
+                max_size=None,
+                # No receive queue limit in the library; backpressure comes from the
+                # per-client queues, bounded by CLIENT_QUEUE_SIZE, which the forwarder
+                # waits on, and from the drain timeout that drops stalled clients
+                max_queue=None
             )
             logger.info("✓ WebSocket ADB connected successfully")
             return True
@@ -52,169 +121,215 @@ class WebSocketADBBridge:
     
     async def start_tcp_server(self):
         """Start local TCP server for ADB clients"""
-        try:
-            logger.info(f"Starting TCP server on localhost:{self.local_port}")
-            
-            # Create server socket
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind(('localhost', self.local_port))
-            self.server_socket.listen(5)
-            self.server_socket.settimeout(1.0)  # Non-blocking accept
-            
-            logger.info(f"✓ TCP server listening on localhost:{self.local_port}")
-            
-            while self.running:
-                try:
-                    client_socket, client_address = self.server_socket.accept()
-                    logger.info(f"New ADB client connected from {client_address}")
-                    
-                    # Handle client in separate task
-                    asyncio.create_task(self.handle_client(client_socket))
-                    
-                except socket.timeout:
-                    continue  # Check if still running
-                except Exception as e:
-                    if self.running:
-                        logger.error(f"Server accept error: {e}")
-                    break
-                    
-        except Exception as e:
-            logger.error(f"Failed to start TCP server: {e}")
+        logger.info(f"Starting TCP server on localhost:{self.local_port}")
+        
+        # Accepts are driven by the event loop selector, no polling needed
+        self.server = await asyncio.start_server(
+            self._on_client,
+            'localhost',
+            self.local_port,
+            # Room for bursts of adb clients reconnecting at once
+            backlog=LISTEN_BACKLOG,
+            reuse_address=True
+        )
+        
+        logger.info(f"✓ TCP server listening on localhost:{self.local_port}")
     
-    async def handle_client(self, client_socket):
+    async def _on_client(self, reader, writer):
         """Handle individual ADB client connection"""
-        logger.info(f"Handling new ADB client connection")
+        client_address = writer.get_extra_info('peername')
+        logger.info(f"New ADB client connected from {client_address}")
+        
+        # Disable Nagle so small ADB protocol packets are forwarded immediately.
+        # SO_RCVBUF/SO_SNDBUF are left alone: a fixed size turns off kernel
+        # autotuning, which on loopback already grows well past any fixed value.
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError as e:
+                logger.debug(f"Could not set TCP_NODELAY: {e}")
+        
+        client = ADBClient(writer)
+        self.clients.add(client)
+        writer_task = asyncio.create_task(self._client_writer(client))
         try:
-            self.clients.append(client_socket)
-            client_socket.settimeout(5.0)  # Longer timeout for handshake
-            
             while self.running and self.websocket:
-                try:
-                    # Read from ADB client (non-blocking)
-                    data = client_socket.recv(8192)
-                    if not data:
-                        logger.debug("Client disconnected")
-                        break
-                        
-                    logger.debug(f"Client->WebSocket: {len(data)} bytes")
-                    # Forward to WebSocket
-                    await self.websocket.send(data)
-                    
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    logger.debug(f"Client read error: {e}")
+                # Read from ADB client, waiting on the selector without blocking the loop.
+                # StreamReader has no recv_into(), so a pool of reusable buffers cannot
+                # be filled from the socket here; that needs asyncio.BufferedProtocol.
+                data = await reader.read(READ_CHUNK_SIZE)
+                if not data:
+                    logger.debug("Client disconnected")
                     break
                     
+                logger.debug(f"Client->WebSocket: {len(data)} bytes")
+                # Forward to WebSocket
+                await self.websocket.send(data)
+                
         except Exception as e:
-            logger.error(f"Client handler error: {e}")
+            logger.debug(f"Client read error: {e}")
         finally:
+            self.clients.discard(client)
+            writer_task.cancel()
+            client.close()
             try:
-                client_socket.close()
-                if client_socket in self.clients:
-                    self.clients.remove(client_socket)
-                logger.debug("Client connection closed")
-            except:
+                await writer.wait_closed()
+            except Exception:
                 pass
+            logger.debug("Client connection closed")
+    
+    async def _client_writer(self, client):
+        """Write queued WebSocket messages to an ADB client"""
+        try:
+            while True:
+                # Coalesce back-to-back messages into a single write and drain
+                batch = [await client.queue.get()]
+                batch_size = len(batch[0])
+                while not client.queue.empty() and batch_size < WRITE_BATCH_SIZE:
+                    message = client.queue.get_nowait()
+                    batch.append(message)
+                    batch_size += len(message)
+                # Join rather than writelines(): on some Python versions writelines()
+                # skips write flow control, which would make drain() return at once
+                client.writer.write(batch[0] if len(batch) == 1 else b''.join(batch))
+                await asyncio.wait_for(client.writer.drain(), timeout=CLIENT_DRAIN_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            # Drop only the congested client, others keep being served
+            logger.warning("ADB client is not reading, disconnecting")
+            self.clients.discard(client)
+            client.abort()
+        except Exception as e:
+            logger.debug(f"Failed to send to client: {e}")
+            self.clients.discard(client)
+            client.close()
     
     async def websocket_forwarder(self):
         """Forward WebSocket messages to TCP clients"""
         try:
-            while self.running and self.websocket:
-                try:
-                    # Receive from WebSocket
-                    message = await asyncio.wait_for(self.websocket.recv(), timeout=2.0)
-                    
-                    if self.clients:
-                        logger.debug(f"WebSocket->Clients: {len(message)} bytes to {len(self.clients)} clients")
-                    
-                    # Forward to all ADB clients
-                    for client_socket in self.clients[:]:  # Copy to avoid modification during iteration
-                        try:
-                            # Use non-blocking send
-                            client_socket.settimeout(0.5)
-                            client_socket.send(message)
-                        except Exception as e:
-                            logger.debug(f"Failed to send to client: {e}")
-                            # Remove dead connections
-                            try:
-                                self.clients.remove(client_socket)
-                                client_socket.close()
-                            except:
-                                pass
-                                
-                except asyncio.TimeoutError:
-                    continue
-                except websockets.exceptions.ConnectionClosed:
-                    logger.warn("WebSocket connection closed")
-                    break
-                except Exception as e:
-                    logger.error(f"WebSocket receive error: {e}")
-                    break
-                    
+            # Iteration ends as soon as the WebSocket closes, including when a
+            # signal handler calls stop_bridge() while the bridge is running
+            async for message in self.websocket:
+                if self.clients:
+                    logger.debug(f"WebSocket->Clients: {len(message)} bytes to {len(self.clients)} clients")
+                
+                # Hand off to each ADB client's writer task. A full queue makes the
+                # forwarder wait, which stops reading from the WebSocket until the
+                # client catches up; stalled clients are dropped by the drain timeout.
+                for client in list(self.clients):  # Copy to avoid modification during iteration
+                    await client.queue.put(message)
+            
+            logger.warning("WebSocket connection closed")
+        except ConnectionClosed:
+            logger.warning("WebSocket connection closed")
         except Exception as e:
-            logger.error(f"WebSocket forwarder error: {e}")
+            logger.error(f"WebSocket receive error: {e}")
     
     async def run_bridge(self):
         """Main bridge execution"""
         logger.info("Starting WebSocket ADB Bridge...")
         self.running = True
         
-        # Connect to WebSocket
-        if not await self.connect_websocket():
+        # Without a local listener there is nothing to bridge, so fail fast
+        try:
+            await self.start_tcp_server()
+        except Exception as e:
+            logger.error(f"Failed to start TCP server: {e}")
             return False
         
-        # Start TCP server and WebSocket forwarder concurrently
+        # Keep the TCP server up independently of the WebSocket connection
+        server_task = asyncio.create_task(self.server.serve_forever())
+        delay = RECONNECT_INITIAL_DELAY
+        
         try:
-            await asyncio.gather(
-                self.start_tcp_server(),
-                self.websocket_forwarder()
-            )
+            while self.running and not server_task.done():
+                # Connect to WebSocket and forward until the connection drops
+                if await self.connect_websocket():
+                    connected_at = time.monotonic()
+                    await self.websocket_forwarder()
+                    
+                    # Only a connection that stayed up resets the backoff, so a server
+                    # that accepts and then closes at once is retried less and less often
+                    if time.monotonic() - connected_at >= RECONNECT_STABLE_AFTER:
+                        delay = RECONNECT_INITIAL_DELAY
+                    
+                    # ADB sessions do not survive a new WebSocket, so make clients reconnect
+                    websocket, self.websocket = self.websocket, None
+                    self._drop_clients()
+                    try:
+                        await websocket.close()
+                    except Exception:
+                        pass
+                
+                if not self.running or server_task.done():
+                    break
+                
+                logger.info(f"Reconnecting to WebSocket ADB in {delay:.1f}s")
+                # Wait out the backoff, waking early if the TCP server stops
+                await asyncio.wait({server_task}, timeout=delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            
+            if self.running and server_task.done():
+                error = None if server_task.cancelled() else server_task.exception()
+                logger.error(f"TCP server stopped unexpectedly: {error}")
+                return False
+                
         except Exception as e:
             logger.error(f"Bridge execution error: {e}")
             return False
+        finally:
+            server_task.cancel()
         
         return True
     
-    def stop_bridge(self):
+    def _drop_clients(self):
+        """Disconnect all ADB clients"""
+        for client in list(self.clients):
+            client.abort()
+        self.clients.clear()
+    
+    async def stop_bridge(self):
         """Stop the bridge"""
         logger.info("Stopping WebSocket ADB Bridge...")
         self.running = False
         
-        # Close server socket
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
+        # Stop accepting new ADB clients
+        if self.server:
+            self.server.close()
         
         # Close all client connections
-        for client_socket in self.clients[:]:
+        self._drop_clients()
+        
+        # Wait for the TCP server to finish shutting down
+        if self.server:
             try:
-                client_socket.close()
+                await self.server.wait_closed()
             except:
                 pass
-        self.clients.clear()
         
         # Close WebSocket
         if self.websocket:
             try:
-                asyncio.create_task(self.websocket.close())
+                await self.websocket.close()
             except:
                 pass
 
 async def main():
     """Main execution function"""
+    # Python 3.12+: start tasks eagerly so client handlers and writer tasks
+    # run to their first real wait without an extra event loop iteration
+    if hasattr(asyncio, 'eager_task_factory'):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    
     # Get WebSocket URL from environment or connection file
     websocket_url = os.environ.get('GENYMOTION_WEBSOCKET_URL')
     if not websocket_url:
         try:
-            with open('/tmp/genymotion_connection.env', 'r') as f:
-                for line in f:
-                    if 'GENYMOTION_ADB_URL=' in line or 'publicAdbUrl=' in line:
-                        websocket_url = line.split('=', 1)[1].strip().strip('"')
-                        break
+            match = _ENV_URL_RE.search(Path(CONNECTION_ENV_FILE).read_text())
+            if match:
+                websocket_url = match.group(1).strip()
         except FileNotFoundError:
             pass
     
@@ -237,6 +352,21 @@ async def main():
     # Create and run bridge
     bridge = WebSocketADBBridge(ws_url, 5555)
     
+    # Stop the running bridge on SIGTERM/SIGINT instead of waiting for it to return
+    loop = asyncio.get_running_loop()
+    stop_tasks = set()
+    
+    def request_stop():
+        task = asyncio.create_task(bridge.stop_bridge())
+        stop_tasks.add(task)
+        task.add_done_callback(stop_tasks.discard)
+    
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, request_stop)
+        except (NotImplementedError, RuntimeError):
+            pass
+    
     try:
         success = await bridge.run_bridge()
         return 0 if success else 1
@@ -247,11 +377,18 @@ async def main():
         logger.error(f"Bridge failed: {e}")
         return 1
     finally:
-        bridge.stop_bridge()
+        # Let a signal-triggered stop finish, then stop here if nothing did
+        if stop_tasks:
+            await asyncio.gather(*stop_tasks, return_exceptions=True)
+        if bridge.running:
+            await bridge.stop_bridge()
 
 if __name__ == "__main__":
     try:
-        exit_code = asyncio.run(main())
+        if uvloop is not None:
+            exit_code = uvloop.run(main())
+        else:
+            exit_code = asyncio.run(main())
         sys.exit(exit_code)
     except KeyboardInterrupt:
         logger.info("Bridge stopped by user")